@@ -5,36 +5,38 @@ import json
 import time
 import sys
 import subprocess
+import importlib.util
+import functools
 import logging
 import threading
+import asyncio
+import queue
+import tempfile
+import uuid
+import sqlite3
+from contextlib import closing, asynccontextmanager
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import List, Optional, Dict, Any, Union
 
 # Import FastAPI libraries
 from fastapi import FastAPI, HTTPException, BackgroundTasks, Query, Body, Path as PathParam
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from fastapi.responses import Response
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field, TypeAdapter
 import uvicorn
 
 # Import python-dotenv to load .env file
 from dotenv import load_dotenv
 
-import torch
-from huggingface_hub import snapshot_download, HfApi
-import requests
+from huggingface_hub import snapshot_download, HfApi, constants as hf_constants
+import httpx
 
-# Tentative d'import des libs optionnelles
-try:
-    from safetensors.torch import load_file
-    SAFE_TENSORS_AVAILABLE = True
-except ImportError:
-    SAFE_TENSORS_AVAILABLE = False
-
-try:
-    from transformers import AutoConfig
-    TRANSFORMERS_AVAILABLE = True
-except ImportError:
-    TRANSFORMERS_AVAILABLE = False
+# Libs optionnelles lourdes (torch, transformers, safetensors): importées à la demande
+SAFE_TENSORS_AVAILABLE = importlib.util.find_spec("safetensors") is not None
+TRANSFORMERS_AVAILABLE = importlib.util.find_spec("transformers") is not None
 
 try:
     import psutil
@@ -62,6 +64,56 @@ CACHE_PHOTOGRAM = CACHE_DIR / "photogram_models"
 
 # Outils système
 ARIA2_AVAILABLE = shutil.which("aria2c") is not None
+ARIA2_CONCURRENT_FILES = int(os.getenv("KIBALI_ARIA2_JOBS", "8"))
+
+# Clients réseau partagés (évite un handshake TLS par appel)
+_HF_API = HfApi(token=HF_TOKEN)
+# HF_ENDPOINT (miroir) respecté comme par HfApi; pas de transport custom pour garder HTTPS_PROXY/ALL_PROXY
+HF_ENDPOINT = hf_constants.ENDPOINT.rstrip("/")
+_HF_HTTP_OPTIONS = dict(
+    base_url=HF_ENDPOINT,
+    http2=True,
+    timeout=5,
+    follow_redirects=True,
+    headers={"Authorization": f"Bearer {HF_TOKEN}"} if HF_TOKEN else {},
+)
+HTTPX = httpx.AsyncClient(**_HF_HTTP_OPTIONS)
+# Pendant synchrone pour les threads de téléchargement (hors boucle d'événements)
+HTTPX_SYNC = httpx.Client(**_HF_HTTP_OPTIONS)
+
+# Nombre maximal de repos par appel à /models/check-remote-batch
+MAX_BATCH_CHECK = 32
+
+# Octets lus au maximum pour détecter les clés d'un config.json distant
+CONFIG_PROBE_BYTES = 16 * 1024
+
+# File de téléchargements consommée par un nombre fixe de workers
+DOWNLOAD_WORKERS = int(os.getenv("KIBALI_DOWNLOAD_WORKERS", "2"))
+DL_QUEUE: "queue.Queue[str]" = queue.Queue()
+DL_STATUS: Dict[str, Dict[str, Any]] = {}
+_DL_STATUS_LOCK = threading.Lock()
+
+# Index SQLite des modèles locaux (évite de rescanner les snapshots inchangés)
+INDEX_DB = CACHE_HF / ".kibali_index.sqlite"
+
+# Durée de validité (s) des résultats de /models/search
+SEARCH_CACHE_TTL = 60
+
+# Préfixe des dossiers renommés en attente de suppression
+TRASH_PREFIX = ".deleting-"
+
+# Cache des métadonnées distantes: clé -> (valeur, expiration), borné en taille
+HF_META_TTL = 300
+HF_META_MAX_ENTRIES = 256
+_HF_META_CACHE: "OrderedDict[Any, Any]" = OrderedDict()
+_HF_META_LOCK = threading.Lock()
+
+# Pool partagé pour scanner les modèles locaux en parallèle (I/O bound)
+SCAN_EXECUTOR = ThreadPoolExecutor(max_workers=min(16, (os.cpu_count() or 1) * 4), thread_name_prefix="kibali-scan")
+
+# Cache de la réponse /models, invalidé si les mtimes des snapshots changent
+_MODELS_CACHE: Dict[str, Any] = {"sig": None, "body": None, "gen": 0}
+_MODELS_CACHE_LOCK = threading.Lock()
 
 # ===============================
 # MODÈLES DE DONNÉES (Pydantic)
@@ -90,6 +142,8 @@ class SearchResult(BaseModel):
     likes: int
     pipeline_tag: Optional[str]
 
+_MODEL_LIST = TypeAdapter(List[ModelInfo])
+
 class SearchPayload(BaseModel):
     query: str
     limit: int = 10
@@ -97,6 +151,9 @@ class SearchPayload(BaseModel):
 class DownloadPayload(BaseModel):
     repo_id: str
 
+class BatchCheckPayload(BaseModel):
+    repo_ids: List[str] = Field(..., max_length=MAX_BATCH_CHECK)
+
 class VerifyPayload(BaseModel):
     repo_id: str
 
@@ -112,44 +169,183 @@ class SnippetResponse(BaseModel):
 # LOGIQUE MÉTIER
 # ===============================
 
+_SIZE_UNITS = ('', 'K', 'M', 'G', 'T', 'P', 'E', 'Z', 'Y')
+
 def sizeof_fmt(num, suffix='B'):
-    for unit in ['','K','M','G','T','P','E','Z']:
-        if abs(num) < 1024.0:
-            return f"{num:3.1f}{unit}{suffix}"
-        num /= 1024.0
-    return f"{num:.1f}Y{suffix}"
+    # Unité choisie par bit_length (une puissance de 1024 = 10 bits) plutôt qu'une boucle de divisions
+    n = int(abs(num))
+    i = min((n.bit_length() - 1) // 10, 8) if n > 0 else 0
+    return f"{num / (1 << (10 * i)):3.1f}{_SIZE_UNITS[i]}{suffix}"
+
+@functools.lru_cache(maxsize=1)
+def cuda_available() -> bool:
+    """Importe torch au premier appel seulement, et mémorise le résultat."""
+    try:
+        import torch
+        return torch.cuda.is_available()
+    except ImportError:
+        return False
+
+@functools.lru_cache(maxsize=1)
+def gpu_diagnostics() -> Dict[str, str]:
+    """Infos GPU (statiques). Le premier appel crée le contexte CUDA: à garder hors de la boucle."""
+    if not cuda_available():
+        return {"Disponible": "Non"}
+    import torch
+    d = torch.cuda.current_device()
+    props = torch.cuda.get_device_properties(d)
+    return {
+        "Disponible": "Oui",
+        "Nom GPU": props.name,
+        "VRAM": sizeof_fmt(props.total_memory)
+    }
+
+async def cached_in_threadpool(fn):
+    """Appelle une fonction lru_cache sans argument: threadpool au premier appel seulement."""
+    if fn.cache_info().currsize:
+        return fn()
+    return await run_in_threadpool(fn)
+
+def iter_files(path: Path):
+    """Parcourt `path` avec os.scandir et renvoie (nom, taille) pour chaque fichier."""
+    stack = [str(path)]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file():
+                            # Les snapshots HF sont des symlinks vers blobs/: on suit le lien pour la taille
+                            yield entry.name, entry.stat().st_size
+                    except OSError:
+                        pass
+        except OSError:
+            pass
 
 def get_dir_size(path: Path):
-    total = 0
+    total = sum(size for _, size in iter_files(path))
+    return total, sizeof_fmt(total)
+
+def scan_snapshot(path: Path):
+    """Une seule passe: taille totale + présence de poids PyTorch / TensorFlow."""
+    total, has_pt, has_tf = 0, False, False
+    for name, size in iter_files(path):
+        total += size
+        if name.endswith(('.bin', '.safetensors')):
+            has_pt = True
+        elif name.endswith('.h5'):
+            has_tf = True
+    return total, has_pt, has_tf
+
+_MISS = object()
+
+def _meta_get(key):
+    with _HF_META_LOCK:
+        hit = _HF_META_CACHE.get(key)
+    if hit and hit[1] > time.monotonic():
+        return hit[0]
+    return _MISS
+
+def _meta_put(key, value):
+    now = time.monotonic()
+    with _HF_META_LOCK:
+        _HF_META_CACHE.pop(key, None)
+        _HF_META_CACHE[key] = (value, now + HF_META_TTL)
+        # Ordre d'insertion = ordre d'expiration: on purge par la tête
+        while _HF_META_CACHE:
+            oldest_key, (_, expires) = next(iter(_HF_META_CACHE.items()))
+            if expires > now and len(_HF_META_CACHE) <= HF_META_MAX_ENTRIES:
+                break
+            del _HF_META_CACHE[oldest_key]
+    return value
+
+def _cached_meta(key, fetch):
+    """Retourne la valeur en cache pour `key` ou appelle `fetch()` si absente/expirée."""
+    value = _meta_get(key)
+    if value is _MISS:
+        value = _meta_put(key, fetch())
+    return value
+
+# Une seule entrée de cache par repo (JSON de /api/models: sha, config, siblings),
+# partagée entre l'analyse distante (async) et les téléchargements (threads)
+async def hf_model_json(repo_id: str) -> Dict[str, Any]:
+    key = ("api", repo_id)
+    value = _meta_get(key)
+    if value is _MISS:
+        resp = await HTTPX.get(f"/api/models/{repo_id}")
+        resp.raise_for_status()
+        value = _meta_put(key, resp.json())
+    return value
+
+def _fetch_model_json(repo_id: str) -> Dict[str, Any]:
+    resp = HTTPX_SYNC.get(f"/api/models/{repo_id}")
+    resp.raise_for_status()
+    return resp.json()
+
+def hf_repo_info(repo_id: str) -> Dict[str, Any]:
+    """Version synchrone de hf_model_json (même entrée de cache)."""
+    return _cached_meta(("api", repo_id), lambda: _fetch_model_json(repo_id))
+
+def hf_list_repo_files(repo_id: str) -> List[str]:
+    siblings = hf_repo_info(repo_id).get("siblings")
+    if siblings is not None:
+        return [s["rfilename"] for s in siblings]
+    return _cached_meta(("files", repo_id), lambda: _HF_API.list_repo_files(repo_id))
+
+def aria2_file_allocation(path: Path) -> str:
+    """Choisit la stratégie d'allocation aria2: `falloc` si le FS la supporte, sinon `none`."""
+    if sys.platform == "win32":
+        return "falloc"
     try:
-        for f in path.rglob('*'):
-            if f.is_file():
-                total += f.stat().st_size
-    except Exception:
+        target = str(path.resolve())
+        best, fstype = "", ""
+        with open("/proc/mounts") as f:
+            for line in f:
+                parts = line.split()
+                mount = parts[1] if len(parts) >= 3 else ""
+                if mount and (target == mount or target.startswith(mount.rstrip("/") + "/")) and len(mount) > len(best):
+                    best, fstype = mount, parts[2]
+        if fstype in ("ext4", "xfs", "btrfs", "ntfs3"):
+            return "falloc"
+    except OSError:
         pass
-    return total, sizeof_fmt(total)
+    return "none"
 
-def analyze_remote_repo(repo_id: str) -> Dict[str, Any]:
+def config_has_key(raw: bytes, *keys: bytes) -> bool:
+    """Présence d'une clé dans un config.json, sans parser tout le JSON."""
+    return any(k in raw for k in keys)
+
+async def analyze_remote_repo(repo_id: str) -> Dict[str, Any]:
     """Analyse un repo distant pour déterminer s'il est standard HF ou Custom."""
     is_standard = False
     custom_files = []
     
     try:
-        api = HfApi(token=HF_TOKEN)
-        # 1. Vérifier config.json
-        try:
-            url = f"https://huggingface.co/{repo_id}/resolve/main/config.json"
-            headers = {"Authorization": f"Bearer {HF_TOKEN}"} if HF_TOKEN else {}
-            resp = requests.get(url, headers=headers, timeout=5)
-            if resp.status_code == 200:
-                config = resp.json()
-                if 'architectures' in config or 'model_type' in config:
-                    is_standard = True
-        except:
-            pass
+        # 1. Vérifier la config (fournie par /api/models, sinon lecture de config.json)
+        info = await hf_model_json(repo_id)
+        config = info.get("config")
+        if config is not None:
+            is_standard = 'architectures' in config or 'model_type' in config
+        else:
+            try:
+                # Range: seuls les premiers Ko sont transférés (206); si ignoré, on coupe le flux quand même
+                probe_range = {"Range": f"bytes=0-{CONFIG_PROBE_BYTES - 1}"}
+                async with HTTPX.stream("GET", f"/{repo_id}/resolve/main/config.json", headers=probe_range) as resp:
+                    if resp.status_code in (200, 206):
+                        head = b""
+                        async for chunk in resp.aiter_bytes():
+                            head += chunk
+                            if len(head) >= CONFIG_PROBE_BYTES:
+                                break
+                        is_standard = config_has_key(head[:CONFIG_PROBE_BYTES], b'"architectures"', b'"model_type"')
+            except Exception:
+                pass
 
         # 2. Lister les fichiers pour détecter du code custom
-        files = api.list_repo_files(repo_id)
+        files = [s["rfilename"] for s in info.get("siblings") or []]
         root_py = [f for f in files if f.endswith('.py') and '/' not in f and f not in ['requirements.txt', 'setup.py']]
         
         if len(root_py) > 0:
@@ -164,29 +360,79 @@ def analyze_remote_repo(repo_id: str) -> Dict[str, Any]:
     
     return {"is_standard": is_standard, "custom_files": custom_files}
 
+@functools.lru_cache(maxsize=128)
+def cached_search(query: str, limit: int, bucket: int):
+    """Recherche HF mise en cache par (query, limit, tranche de temps)."""
+    results = []
+    # list_models est paginé paresseusement: l'itération fait les appels réseau
+    for m in _HF_API.list_models(search=query, sort="downloads", direction=-1, limit=limit):
+        tags = m.tags or []
+        results.append({
+            "id": m.id,
+            "author": m.author,
+            "downloads": m.downloads,
+            # Heuristique rapide pour 'standard'
+            "is_standard": "transformers" in tags,
+            "tags": tags,
+            "likes": getattr(m, 'likes', 0) or 0,
+            "pipeline_tag": m.pipeline_tag,
+        })
+    return tuple(results)
+
+def set_download_status(repo_id: str, status: str, detail: str = ""):
+    with _DL_STATUS_LOCK:
+        DL_STATUS[repo_id] = {"status": status, "detail": detail, "updated": time.time()}
+
+def is_up_to_date(repo_id: str) -> bool:
+    """True si refs/main pointe sur un snapshot local avec des poids ET égal au sha distant."""
+    model_dir = CACHE_HF / f"models--{repo_id.replace('/', '--')}"
+    ref = model_dir / "refs" / "main"
+    if not ref.exists():
+        return False
+    local_sha = ref.read_text().strip()
+    snap = model_dir / "snapshots" / local_sha
+    if not snap.is_dir():
+        return False
+    _, has_pt, has_tf = scan_snapshot(snap)
+    if not (has_pt or has_tf):
+        return False
+    return hf_repo_info(repo_id).get("sha") == local_sha
+
 def download_worker(repo_id: str):
     logger.info(f"🚀 Démarrage téléchargement: {repo_id}")
+    set_download_status(repo_id, "downloading")
     try:
         model_name = repo_id.replace("/", "--")
         
+        if is_up_to_date(repo_id):
+            logger.info(f"✅ Déjà à jour: {repo_id}")
+            set_download_status(repo_id, "done", "Déjà à jour")
+            return
+        
         if ARIA2_AVAILABLE:
-            api = HfApi(token=HF_TOKEN)
-            info = api.repo_info(repo_id)
-            commit_hash = info.sha
+            commit_hash = hf_repo_info(repo_id)["sha"]
             
             storage_folder = CACHE_HF / f"models--{model_name}" / "snapshots" / commit_hash
             storage_folder.mkdir(parents=True, exist_ok=True)
             
-            files = api.list_repo_files(repo_id)
-            for file in files:
-                url = f"https://huggingface.co/{repo_id}/resolve/main/{file}"
-                local_dir = storage_folder / Path(file).parent
-                local_dir.mkdir(parents=True, exist_ok=True)
-                
-                cmd = ["aria2c", "-x16", "-s16", "-k1M", "-c", "-d", str(local_dir), "-o", Path(file).name, url]
+            files = hf_list_repo_files(repo_id)
+            # Un seul appel aria2c pour tous les fichiers (téléchargements parallèles)
+            with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as listing:
+                for file in files:
+                    # URL figée sur le sha: les fichiers correspondent au dossier snapshots/<sha>
+                    listing.write(f"{HF_ENDPOINT}/{repo_id}/resolve/{commit_hash}/{file}\n")
+                    listing.write(f"  dir={storage_folder}\n")
+                    listing.write(f"  out={file}\n")
+            try:
+                cmd = ["aria2c", "-i", listing.name, f"-j{ARIA2_CONCURRENT_FILES}", "-x16", "-s16", "-k1M", "-c",
+                       "--auto-file-renaming=false", "--optimize-concurrent-downloads=true",
+                       f"--file-allocation={aria2_file_allocation(storage_folder)}", "--disk-cache=64M",
+                       "--enable-mmap=true", "--conditional-get=true", "--remote-time=true"]
                 if HF_TOKEN:
                     cmd.append(f"--header=Authorization: Bearer {HF_TOKEN}")
                 subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+            finally:
+                os.unlink(listing.name)
             
             # Création refs
             refs_path = CACHE_HF / f"models--{model_name}" / "refs"
@@ -197,8 +443,58 @@ def download_worker(repo_id: str):
             snapshot_download(repo_id, cache_dir=str(CACHE_HF), token=HF_TOKEN)
             
         logger.info(f"✅ Téléchargement terminé: {repo_id}")
+        set_download_status(repo_id, "done")
     except Exception as e:
         logger.error(f"❌ Erreur téléchargement {repo_id}: {e}")
+        set_download_status(repo_id, "error", str(e))
+    finally:
+        # Succès ou échec: une ligne écrite pendant le téléchargement (snapshot partiel) est périmée
+        refresh_model_index(repo_id)
+        invalidate_models_cache()
+
+def move_to_trash(path: Path) -> Path:
+    """Renomme `path` (atomique, instantané) pour le supprimer plus tard en tâche de fond."""
+    trash = path.with_name(f"{TRASH_PREFIX}{uuid.uuid4().hex}-{path.name}")
+    path.rename(trash)
+    return trash
+
+def purge_trash(paths: List[Path]):
+    for p in paths:
+        shutil.rmtree(p, ignore_errors=True)
+
+def models_signature():
+    """Signature bon marché du cache HF: (dossier modèle, [(snapshot, mtime_ns)])."""
+    sig = []
+    try:
+        with os.scandir(CACHE_HF) as it:
+            for d in it:
+                if not (d.name.startswith("models--") and d.is_dir()):
+                    continue
+                snaps = ()
+                try:
+                    with os.scandir(os.path.join(d.path, "snapshots")) as sit:
+                        snaps = tuple(sorted((e.name, e.stat().st_mtime_ns) for e in sit))
+                except OSError:
+                    pass
+                sig.append((d.name, snaps))
+    except OSError:
+        pass
+    return tuple(sorted(sig))
+
+def invalidate_models_cache():
+    with _MODELS_CACHE_LOCK:
+        _MODELS_CACHE["sig"] = None
+        _MODELS_CACHE["body"] = None
+        _MODELS_CACHE["gen"] += 1
+
+def download_consumer():
+    """Boucle d'un worker: traite les repo_id de DL_QUEUE un par un."""
+    while True:
+        repo_id = DL_QUEUE.get()
+        try:
+            download_worker(repo_id)
+        finally:
+            DL_QUEUE.task_done()
 
 def analyze_local_model(model_path: Path):
     """Analyse un modèle déjà téléchargé."""
@@ -209,9 +505,7 @@ def analyze_local_model(model_path: Path):
     config_path = model_path / 'config.json'
     if config_path.exists():
         try:
-            with open(config_path, 'r') as f:
-                config = json.load(f)
-            if 'architectures' in config: is_std = True
+            is_std = config_has_key(config_path.read_bytes(), b'"architectures"')
         except: pass
         
     # Check python files
@@ -224,11 +518,130 @@ def analyze_local_model(model_path: Path):
     
     return is_std, custom_files
 
+def local_model_dirs() -> List[Path]:
+    if not CACHE_HF.exists():
+        return []
+    return [d for d in CACHE_HF.iterdir() if d.is_dir() and d.name.startswith("models--")]
+
+def warm_model_index():
+    """Remplit l'index SQLite au démarrage (sans torch ni cache de réponse)."""
+    for _ in SCAN_EXECUTOR.map(scan_model_dir, local_model_dirs()):
+        pass
+
+def latest_snapshot(snap_dir: Path):
+    """Snapshot le plus récent et son mtime_ns, en une passe os.scandir (stat mis en cache)."""
+    with os.scandir(snap_dir) as it:
+        entries = [(e.stat().st_mtime_ns, e.path) for e in it]
+    mtime_ns, path = max(entries)
+    return Path(path), mtime_ns
+
+def index_db() -> sqlite3.Connection:
+    conn = sqlite3.connect(str(INDEX_DB), timeout=10)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS models ("
+        "repo_id TEXT PRIMARY KEY, snap_path TEXT, size_bytes INTEGER, has_pt INTEGER, has_tf INTEGER, "
+        "is_std INTEGER, custom_files_json TEXT, mtime_ns INTEGER)"
+    )
+    return conn
+
+def index_lookup(repo_id: str, snap_path: str, mtime_ns: int):
+    """Ligne indexée si elle correspond encore au snapshot (même chemin, même mtime)."""
+    try:
+        with closing(index_db()) as conn:
+            return conn.execute(
+                "SELECT size_bytes, has_pt, has_tf, is_std, custom_files_json FROM models "
+                "WHERE repo_id = ? AND snap_path = ? AND mtime_ns = ?",
+                (repo_id, snap_path, mtime_ns),
+            ).fetchone()
+    except sqlite3.Error as e:
+        logger.warning(f"Index SQLite indisponible: {e}")
+        return None
+
+def index_upsert(repo_id: str, snap_path: str, mtime_ns: int, size_b: int, has_pt: bool, has_tf: bool,
+                 is_std: bool, custom_files: List[str]):
+    try:
+        with closing(index_db()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO models VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (repo_id, snap_path, size_b, has_pt, has_tf, is_std, json.dumps(custom_files), mtime_ns),
+            )
+    except sqlite3.Error as e:
+        logger.warning(f"Index SQLite indisponible: {e}")
+
+def index_delete(repo_ids: List[str]):
+    try:
+        with closing(index_db()) as conn, conn:
+            conn.executemany("DELETE FROM models WHERE repo_id = ?", [(r,) for r in repo_ids])
+    except sqlite3.Error as e:
+        logger.warning(f"Index SQLite indisponible: {e}")
+
+def refresh_model_index(repo_id: str):
+    """Rescanne le modèle dans l'index SQLite, ou retire sa ligne s'il n'a plus de snapshot."""
+    if scan_model_dir(CACHE_HF / f"models--{repo_id.replace('/', '--')}", refresh=True) is None:
+        index_delete([repo_id])
+
+def scan_model_dir(d: Path, refresh: bool = False, cuda: bool = False) -> Optional[ModelInfo]:
+    """Construit la fiche d'un dossier `models--*` du cache HF (None si pas de snapshot).
+
+    Les infos viennent de l'index SQLite tant que le snapshot n'a pas changé;
+    `refresh=True` force un rescan (ex: fin de téléchargement). `cuda` est fourni
+    par l'appelant pour que les scans (index, téléchargements) n'importent pas torch.
+    """
+    try:
+        repo_id = d.name.replace("models--", "").replace("--", "/")
+        snapshots = d / "snapshots"
+        if not snapshots.exists(): return None
+        # Prendre le snapshot le plus récent
+        latest_snap, mtime_ns = latest_snapshot(snapshots)
+        
+        row = None if refresh else index_lookup(repo_id, str(latest_snap), mtime_ns)
+        if row:
+            size_b, has_pt, has_tf, is_std = row[0], bool(row[1]), bool(row[2]), bool(row[3])
+            custom_files = json.loads(row[4])
+        else:
+            size_b, has_pt, has_tf = scan_snapshot(latest_snap)
+            is_std, custom_files = analyze_local_model(latest_snap)
+            index_upsert(repo_id, str(latest_snap), mtime_ns, size_b, has_pt, has_tf, is_std, custom_files)
+        size_str = sizeof_fmt(size_b)
+        
+        return ModelInfo(
+            nom=d.name,
+            repo_id=repo_id,
+            chemin=str(latest_snap),
+            taille_fmt=size_str,
+            taille_bytes=size_b,
+            statut="Complet" if size_b > 10*1024*1024 else "Incomplet",
+            type="HuggingFace",
+            pytorch=has_pt,
+            tf=has_tf,
+            cuda_compatible=cuda,
+            standard_hf=is_std,
+            custom_files=custom_files
+        )
+    except Exception as e:
+        logger.error(f"Erreur lecture {d.name}: {e}")
+        return None
+
 # ===============================
 # API APPLICATION
 # ===============================
 
-app = FastAPI(title="Kibali Backend Pro", version="3.1.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    for i in range(DOWNLOAD_WORKERS):
+        threading.Thread(target=download_consumer, name=f"kibali-dl-{i}", daemon=True).start()
+    # Premier passage pour remplir l'index SQLite sans bloquer le démarrage
+    threading.Thread(target=warm_model_index, name="kibali-index", daemon=True).start()
+    # Termine les suppressions interrompues par un redémarrage
+    if CACHE_HF.exists():
+        leftovers = [d for d in CACHE_HF.iterdir() if d.name.startswith(TRASH_PREFIX)]
+        if leftovers:
+            threading.Thread(target=purge_trash, args=(leftovers,), daemon=True).start()
+    yield
+    await HTTPX.aclose()
+    HTTPX_SYNC.close()
+
+app = FastAPI(title="Kibali Backend Pro", version="3.1.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -238,12 +651,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# `/` et `/diagnostics` sont sondés en continu par le frontend: async pour ne jamais
+# attendre un thread libre derrière un scan ou une suppression
 @app.get("/")
-def root():
-    return {"status": "Kibali Backend Online", "aria2": ARIA2_AVAILABLE, "cuda": torch.cuda.is_available()}
+async def root():
+    # Premier appel: import de torch hors de la boucle d'événements
+    cuda = await cached_in_threadpool(cuda_available)
+    return {"status": "Kibali Backend Online", "aria2": ARIA2_AVAILABLE, "cuda": cuda}
 
 @app.get("/diagnostics")
-def get_diagnostics():
+async def get_diagnostics():
     diag = {}
     if PSUTIL_AVAILABLE:
         mem = psutil.virtual_memory()
@@ -259,97 +676,78 @@ def get_diagnostics():
             "Fréquence": f"{cpu.max/1000:.1f}GHz" if cpu else "N/A"
         }
     
-    if torch.cuda.is_available():
-        d = torch.cuda.current_device()
-        props = torch.cuda.get_device_properties(d)
-        diag["GPU/CUDA"] = {
-            "Disponible": "Oui",
-            "Nom GPU": props.name,
-            "VRAM": sizeof_fmt(props.total_memory)
-        }
-    else:
-        diag["GPU/CUDA"] = {"Disponible": "Non"}
+    diag["GPU/CUDA"] = dict(await cached_in_threadpool(gpu_diagnostics))
         
     return diag
 
 @app.get("/models", response_model=List[ModelInfo])
 def list_models():
-    results = []
-    if CACHE_HF.exists():
-        for d in CACHE_HF.iterdir():
-            if d.is_dir() and d.name.startswith("models--"):
-                try:
-                    repo_id = d.name.replace("models--", "").replace("--", "/")
-                    snapshots = d / "snapshots"
-                    if not snapshots.exists(): continue
-                    # Prendre le snapshot le plus récent
-                    latest_snap = max(snapshots.iterdir(), key=os.path.getmtime)
-                    
-                    size_b, size_str = get_dir_size(latest_snap)
-                    is_std, custom_files = analyze_local_model(latest_snap)
-                    
-                    has_pt = len(list(latest_snap.rglob("*.bin"))) > 0 or len(list(latest_snap.rglob("*.safetensors"))) > 0
-                    has_tf = len(list(latest_snap.rglob("*.h5"))) > 0
-                    
-                    results.append(ModelInfo(
-                        nom=d.name,
-                        repo_id=repo_id,
-                        chemin=str(latest_snap),
-                        taille_fmt=size_str,
-                        taille_bytes=size_b,
-                        statut="Complet" if size_b > 10*1024*1024 else "Incomplet",
-                        type="HuggingFace",
-                        pytorch=has_pt,
-                        tf=has_tf,
-                        cuda_compatible=torch.cuda.is_available(),
-                        standard_hf=is_std,
-                        custom_files=custom_files
-                    ))
-                except Exception as e:
-                    logger.error(f"Erreur lecture {d.name}: {e}")
-    return results
-
-@app.post("/models/check-remote")
-def check_remote(payload: DownloadPayload):
-    """Analyse un repo distant AVANT téléchargement."""
-    analysis = analyze_remote_repo(payload.repo_id)
+    # Réponse déjà encodée en JSON en cache: aucune sérialisation sur un hit
+    sig = models_signature()
+    with _MODELS_CACHE_LOCK:
+        if _MODELS_CACHE["body"] is not None and _MODELS_CACHE["sig"] == sig:
+            return Response(_MODELS_CACHE["body"], media_type="application/json")
+        gen = _MODELS_CACHE["gen"]
+
+    # Une seule détection CUDA par réponse, partagée par toutes les fiches
+    scan = functools.partial(scan_model_dir, cuda=cuda_available())
+    results = [m for m in SCAN_EXECUTOR.map(scan, local_model_dirs()) if m is not None]
+    body = _MODEL_LIST.dump_json(results)
+
+    with _MODELS_CACHE_LOCK:
+        # Ne pas écraser une invalidation survenue pendant le scan
+        if _MODELS_CACHE["gen"] == gen:
+            _MODELS_CACHE["sig"] = sig
+            _MODELS_CACHE["body"] = body
+    return Response(body, media_type="application/json")
+
+def remote_check_result(repo_id: str, analysis: Dict[str, Any]) -> Dict[str, Any]:
     return {
-        "repo_id": payload.repo_id,
+        "repo_id": repo_id,
         "is_standard": analysis["is_standard"],
         "custom_files": analysis["custom_files"],
         "message": "Standard HF (Facile)" if analysis["is_standard"] and not analysis["custom_files"] else "Custom/Complexe (Attention)"
     }
 
+@app.post("/models/check-remote")
+async def check_remote(payload: DownloadPayload):
+    """Analyse un repo distant AVANT téléchargement."""
+    analysis = await analyze_remote_repo(payload.repo_id)
+    return remote_check_result(payload.repo_id, analysis)
+
+@app.post("/models/check-remote-batch")
+async def check_remote_batch(payload: BatchCheckPayload):
+    """Analyse plusieurs repos distants en parallèle (une seule latence réseau)."""
+    analyses = await asyncio.gather(*map(analyze_remote_repo, payload.repo_ids))
+    return [remote_check_result(r, a) for r, a in zip(payload.repo_ids, analyses)]
+
 @app.post("/models/search", response_model=List[SearchResult])
-def search_hf(payload: SearchPayload):
+async def search_hf(payload: SearchPayload):
     try:
-        api = HfApi(token=HF_TOKEN)
-        models = api.list_models(search=payload.query, sort="downloads", direction=-1, limit=payload.limit)
-        results = []
-        for m in models:
-            # Heuristique rapide pour 'standard'
-            is_std = "transformers" in (m.tags or [])
-            
-            results.append(SearchResult(
-                id=m.id,
-                author=m.author,
-                downloads=m.downloads,
-                is_standard=is_std,
-                tags=m.tags if m.tags else [],
-                likes=m.likes if hasattr(m, 'likes') else 0,
-                pipeline_tag=m.pipeline_tag
-            ))
-        return results
+        # Tranche de temps dans la clé: une même recherche est resservie depuis le cache pendant SEARCH_CACHE_TTL
+        bucket = int(time.monotonic() // SEARCH_CACHE_TTL)
+        results = await run_in_threadpool(cached_search, payload.query, payload.limit, bucket)
+        return list(results)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/models/download")
-def download_model_route(payload: DownloadPayload, bg_tasks: BackgroundTasks):
-    bg_tasks.add_task(download_worker, payload.repo_id)
-    return {"status": "queued", "message": f"Téléchargement de {payload.repo_id} démarré."}
+def download_model_route(payload: DownloadPayload):
+    with _DL_STATUS_LOCK:
+        current = DL_STATUS.get(payload.repo_id, {}).get("status")
+        if current in ("queued", "downloading"):
+            return {"status": current, "message": f"Téléchargement de {payload.repo_id} déjà en cours."}
+        DL_STATUS[payload.repo_id] = {"status": "queued", "detail": "", "updated": time.time()}
+    DL_QUEUE.put(payload.repo_id)
+    return {"status": "queued", "position": DL_QUEUE.qsize(), "message": f"Téléchargement de {payload.repo_id} en file d'attente."}
+
+@app.get("/downloads/status")
+def downloads_status():
+    with _DL_STATUS_LOCK:
+        return {"pending": DL_QUEUE.qsize(), "workers": DOWNLOAD_WORKERS, "downloads": dict(DL_STATUS)}
 
 @app.post("/models/snippet", response_model=SnippetResponse)
-def get_usage_snippet(payload: DownloadPayload):
+async def get_usage_snippet(payload: DownloadPayload):
     """Génère le code Python exact pour charger le modèle."""
     repo_id = payload.repo_id
     model_name = repo_id.replace("/", "--")
@@ -360,14 +758,13 @@ def get_usage_snippet(payload: DownloadPayload):
     custom_files = []
 
     if base_path.exists():
-        try:
-            snap = max(base_path.iterdir(), key=os.path.getmtime)
-            local_path = str(snap)
-            is_std, custom_files = analyze_local_model(snap)
-        except: pass
+        entry = await run_in_threadpool(scan_model_dir, base_path.parent)
+        if entry is not None:
+            local_path = entry.chemin
+            is_std, custom_files = entry.standard_hf, entry.custom_files
     else:
         # Si pas téléchargé, on check le remote
-        analysis = analyze_remote_repo(repo_id)
+        analysis = await analyze_remote_repo(repo_id)
         is_std = analysis["is_standard"]
         custom_files = analysis["custom_files"]
 
@@ -415,10 +812,13 @@ def verify_model(payload: VerifyPayload):
         return {"repo_id": payload.repo_id, "fonctionnel": False, "details": "Non installé"}
     
     try:
-        snap = max(base_path.iterdir(), key=os.path.getmtime)
-        is_std, _ = analyze_local_model(snap)
+        entry = scan_model_dir(base_path.parent)
+        if entry is None:
+            return {"repo_id": payload.repo_id, "fonctionnel": False, "details": "Aucun snapshot"}
+        snap, is_std = Path(entry.chemin), entry.standard_hf
         
         if is_std and TRANSFORMERS_AVAILABLE:
+            from transformers import AutoConfig
             AutoConfig.from_pretrained(str(snap), trust_remote_code=True)
             return {"repo_id": payload.repo_id, "fonctionnel": True, "details": "Configuration valide", "path": str(snap)}
         
@@ -432,26 +832,49 @@ def verify_model(payload: VerifyPayload):
         return {"repo_id": payload.repo_id, "fonctionnel": False, "details": str(e)}
 
 @app.delete("/models")
-def delete_model(payload: DeletePayload):
+def delete_model(payload: DeletePayload, bg_tasks: BackgroundTasks):
     model_name = payload.repo_id.replace("/", "--")
     path = CACHE_HF / f"models--{model_name}"
     if path.exists():
-        shutil.rmtree(path)
+        trash = move_to_trash(path)
+        invalidate_models_cache()
+        index_delete([payload.repo_id])
+        bg_tasks.add_task(purge_trash, [trash])
         return {"success": True, "message": "Supprimé"}
     raise HTTPException(404, "Non trouvé")
 
 @app.post("/system/cleanup")
-def cleanup_system(type: str = Query("incomplete")):
+def cleanup_system(bg_tasks: BackgroundTasks, type: str = Query("incomplete")):
     deleted = []
+    trashed = []
     # Logique simplifiée pour l'exemple
     if CACHE_HF.exists():
         for d in CACHE_HF.iterdir():
-            if d.is_dir():
+            if d.is_dir() and not d.name.startswith(TRASH_PREFIX):
                 s, _ = get_dir_size(d)
                 if s < 1024*1024: # < 1Mo = probablement fail
-                    shutil.rmtree(d)
+                    trashed.append(move_to_trash(d))
                     deleted.append(d.name)
+    if deleted:
+        invalidate_models_cache()
+        index_delete([n.replace("models--", "").replace("--", "/") for n in deleted if n.startswith("models--")])
+        bg_tasks.add_task(purge_trash, trashed)
     return {"count": len(deleted), "deleted": deleted}
 
+def server_options() -> Dict[str, Any]:
+    """Options uvicorn (uvloop/httptools sont choisis d'office par uvicorn[standard]).
+
+    Un seul worker par défaut: la file de téléchargements, leur statut et le cache
+    /models vivent dans le processus. WEB_CONCURRENCY > 1 les duplique par worker.
+    """
+    # Un exécutable PyInstaller ne peut pas relancer de workers par import string
+    frozen = getattr(sys, "frozen", False)
+    workers = 1 if frozen else int(os.getenv("WEB_CONCURRENCY", "1"))
+    return {"workers": workers, "log_level": "info"}
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    options = server_options()
+    # Plusieurs workers => uvicorn doit pouvoir réimporter l'app via son chemin
+    module = __spec__.name if __spec__ else "main"
+    target = f"{module}:app" if options["workers"] > 1 else app
+    uvicorn.run(target, host="0.0.0.0", port=8000, **options)
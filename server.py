@@ -1,34 +1,47 @@
 import os
+from pathlib import Path
 import uvicorn
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import Response
+from starlette.exceptions import HTTPException as StarletteHTTPException
 from fastapi.middleware.cors import CORSMiddleware
 
 # Importe ton application FastAPI depuis le dossier backend
 # Assure-toi que dans backend/__init__.py ou via l'import direct ça fonctionne
-from backend.main import app 
+from backend.main import app, server_options
 
 # --- CONFIGURATION DU FRONTEND ---
 # Chemin vers le dossier 'dist' que tu viens de générer
 current_dir = os.path.dirname(os.path.abspath(__file__))
 dist_path = os.path.join(current_dir, "dist")
 
-if os.path.exists(dist_path):
-    # Sert les fichiers statiques (JS, CSS)
-    app.mount("/assets", StaticFiles(directory=os.path.join(dist_path, "assets")), name="assets")
+class SPAStaticFiles(StaticFiles):
+    """StaticFiles qui renvoie index.html (gardé en mémoire) pour les routes inconnues."""
+
+    def __init__(self, *args, index_bytes: bytes, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.index_bytes = index_bytes
 
-    # Route pour servir l'application React (PWA)
-    @app.get("/{full_path:path}")
-    async def serve_frontend(full_path: str):
-        # Si le fichier demandé existe (ex: favicon, logo), on le sert
-        local_file = os.path.join(dist_path, full_path)
-        if full_path != "" and os.path.exists(local_file):
-            return FileResponse(local_file)
-        # Sinon, on renvoie l'index.html (indispensable pour React Router)
-        return FileResponse(os.path.join(dist_path, "index.html"))
+    async def get_response(self, path, scope):
+        try:
+            return await super().get_response(path, scope)
+        except StarletteHTTPException as exc:
+            # Un fichier réellement absent (chunk JS périmé, image...) reste un 404:
+            # seules les routes React (sans extension, hors assets/) reçoivent l'index.html
+            if exc.status_code != 404 or path.startswith("assets/") or os.path.splitext(path)[1]:
+                raise
+            return Response(self.index_bytes, media_type="text/html")
+
+if os.path.exists(dist_path):
+    # Monté après les routes API: sert JS, CSS, favicon, logo... et l'application React (PWA)
+    INDEX_BYTES = Path(dist_path, "index.html").read_bytes()
+    app.mount("/", SPAStaticFiles(directory=dist_path, html=True, index_bytes=INDEX_BYTES), name="spa")
 
 if __name__ == "__main__":
     print("Démarrage de Kibali Store IA...")
     # Lancement sur le port 9000 comme prévu dans ta config Vite
-    uvicorn.run(app, host="0.0.0.0", port=9000)
\ No newline at end of file
+    options = server_options()
+    # Plusieurs workers => uvicorn doit pouvoir réimporter l'app via son chemin
+    target = "server:app" if options["workers"] > 1 else app
+    uvicorn.run(target, host="0.0.0.0", port=9000, **options)
\ No newline at end of file